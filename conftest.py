@@ -0,0 +1,26 @@
+"""
+Shared pytest fixtures for the bot's tests. Async tests are run by
+pytest-asyncio (see pytest.ini).
+"""
+
+import pytest
+
+@pytest.fixture(scope="session")
+def sample_image(tmp_path_factory):
+    """Return a function giving the path of a small PNG in the given color
+    
+    Each color is encoded and written once per test session; tests only read
+    the files, so they can share them.
+    """
+    directory = tmp_path_factory.mktemp("images")
+    paths = {}
+    
+    def make(color='red', size=(100, 100)):
+        if (color, size) not in paths:
+            from PIL import Image
+            image_path = directory / f"test_{color}_{size[0]}x{size[1]}.png"
+            Image.new('RGB', size, color=color).save(image_path)
+            paths[color, size] = str(image_path)
+        return paths[color, size]
+    
+    return make
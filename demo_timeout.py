@@ -6,6 +6,7 @@ This demonstrates the key features implemented for the timeout handling.
 
 import asyncio
 import tempfile
+from pathlib import Path
 from PIL import Image
 from discord_bot import ImageProcessingView, OutputImage
 
@@ -106,12 +107,8 @@ async def demo_timeout_behavior():
     print("• ✅ Image attachments properly created from stored outputs")
     
     # Cleanup
-    import os
     for temp_file in temp_images:
-        try:
-            os.unlink(temp_file)
-        except:
-            pass
+        Path(temp_file).unlink(missing_ok=True)
 
 if __name__ == "__main__":
     asyncio.run(demo_timeout_behavior())
\ No newline at end of file
@@ -10,34 +10,49 @@ and sends the modified image back to the Discord channel.
 import asyncio
 import os
 import logging
+import logging.handlers
+import math
+import queue
+import atexit
+import re
 import sys
-from datetime import datetime
+import time
 from pathlib import Path
-from typing import Optional, Dict, Any, List
+from typing import Optional, Dict, Any, List, Tuple
+from collections import OrderedDict
 import hashlib
+import itertools
 import json
 import io
 
 import discord
 from discord.ext import commands
-import replicate
-import aiohttp
-import aiofiles
 from dotenv import load_dotenv
-from PIL import Image
+
+try:
+    import uvloop
+except ImportError:  # uvloop is not available on Windows
+    uvloop = None
 
 # Load environment variables
 load_dotenv()
 
-# Configure logging
+# Configure logging. Records are queued and written to the log file and
+# stdout by a background thread, so logging never blocks the event loop on I/O.
+log_queue = queue.SimpleQueue()
+log_listener = logging.handlers.QueueListener(
+    log_queue,
+    logging.FileHandler('bot.log'),
+    logging.StreamHandler(sys.stdout),
+    respect_handler_level=True
+)
 logging.basicConfig(
     level=logging.INFO,
     format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.FileHandler('bot.log'),
-        logging.StreamHandler(sys.stdout)
-    ]
+    handlers=[logging.handlers.QueueHandler(log_queue)]
 )
+log_listener.start()
+atexit.register(log_listener.stop)
 logger = logging.getLogger(__name__)
 
 # Bot configuration
@@ -46,16 +61,76 @@ REPLICATE_TOKEN = os.getenv('REPLICATE_API_TOKEN')
 ALLOWED_CHANNEL_ID = os.getenv('ALLOWED_CHANNEL_ID')
 IMAGES_FOLDER = os.getenv('IMAGES_FOLDER', './images')
 MAX_FILE_SIZE_MB = int(os.getenv('MAX_FILE_SIZE_MB', '25'))
+ARCHIVE_INPUTS = os.getenv('ARCHIVE_INPUTS', 'false').lower() == 'true'
+REPLICATE_CONCURRENCY = int(os.getenv('REPLICATE_CONCURRENCY', '4'))
+USER_COOLDOWN_SECONDS = float(os.getenv('USER_COOLDOWN_SECONDS', '10'))
+
+# How many times a throttled Replicate request is retried (negative values
+# mean no retries), and the cap on each backoff wait in seconds
+REPLICATE_MAX_RETRIES = max(0, int(os.getenv('REPLICATE_MAX_RETRIES', '3')))
+REPLICATE_MAX_BACKOFF = 60.0
+
+# Replicate's 429 responses say when capacity frees up, e.g.
+# "Request was throttled. Expected available in 3 seconds."
+THROTTLE_PATTERN = re.compile(r'available in (\d+(?:\.\d+)?) second')
+
+# Number of finished results kept in memory so repeated requests skip Replicate.
+# Off by default: the model's output is random, and a cached result would stop
+# users re-rolling the same prompt for a new variation.
+RESULT_CACHE_SIZE = int(os.getenv('RESULT_CACHE_SIZE', '0'))
+
+# Maximum number of image requests handled at once; extra ones are turned away
+MAX_INFLIGHT = int(os.getenv('MAX_INFLIGHT', '8'))
+HANDLER_SEMAPHORE = asyncio.BoundedSemaphore(MAX_INFLIGHT)
+
+# Discord's limit on embeds in a single message
+MAX_EMBEDS = 10
+
+# File extensions accepted when an attachment has no content type
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.webp', '.gif')
+
+# Matches user mentions in both the <@id> and nickname <@!id> forms
+MENTION_PATTERN = re.compile(r'<@!?\d+>')
+
+# The bot's own mention strings, filled in by on_ready once its ID is known
+BOT_MENTION_TOKENS: Tuple[str, ...] = ()
 
-# Create image directories
-Path(f"{IMAGES_FOLDER}/input").mkdir(parents=True, exist_ok=True)
-Path(f"{IMAGES_FOLDER}/output").mkdir(parents=True, exist_ok=True)
+# Image filenames are this run's start time and PID plus a running counter,
+# so they stay unique across restarts without any per-request hashing
+RUN_ID = f"{time.strftime('%Y%m%d_%H%M%S')}_{os.getpid()}"
+FILE_COUNTER = itertools.count(1)
+
+# Image directories, created by whatever first writes to them
+INPUT_DIR = Path(IMAGES_FOLDER) / "input"
+OUTPUT_DIR = Path(IMAGES_FOLDER) / "output"
 
 # Discord bot setup
 intents = discord.Intents.default()
 intents.message_content = True
 bot = commands.Bot(command_prefix='!', intents=intents)
 
+def is_image_attachment(attachment) -> bool:
+    """Check whether a Discord attachment is an image"""
+    if attachment.content_type:
+        return attachment.content_type.startswith('image/')
+    return attachment.filename.lower().endswith(IMAGE_EXTENSIONS)
+
+def extract_prompt(content: str) -> str:
+    """Strip mentions from a message to get the modification prompt"""
+    # Usually the only mention is the bot's own, which plain replaces handle
+    # without running the regex
+    for token in BOT_MENTION_TOKENS:
+        content = content.replace(token, "", 1)
+    if "<@" in content:
+        content = MENTION_PATTERN.sub("", content)
+    return content.strip()
+
+def write_image_file(path: str, data: bytes) -> None:
+    """Write image data to a file, creating its directory if needed"""
+    file_path = Path(path)
+    file_path.parent.mkdir(parents=True, exist_ok=True)
+    file_path.write_bytes(data)
+
 class OutputImage:
     """Represents an output image with metadata"""
     def __init__(self, image_path: str, prompt: str, filename: str):
@@ -67,6 +142,7 @@ class OutputImage:
     def load_image(self):
         """Load the PIL Image object"""
         if self.image is None and os.path.exists(self.image_path):
+            from PIL import Image
             self.image = Image.open(self.image_path)
         return self.image
 
@@ -75,7 +151,10 @@ class ImageProcessingView(discord.ui.View):
     
     def __init__(self, *, timeout=1800):  # 30 minutes timeout
         super().__init__(timeout=timeout)
+        # Only the first MAX_EMBEDS outputs can ever be shown, so only those
+        # are kept; output_count tracks how many were generated in total
         self.outputs: List[OutputImage] = []
+        self.output_count = 0
         self.message: Optional[discord.Message] = None
         self.processing = False
         
@@ -101,34 +180,33 @@ class ImageProcessingView(discord.ui.View):
                 )
                 embeds.append(embed)
             else:
-                # Create embeds and files for all outputs
-                for i, output in enumerate(self.outputs[:10]):  # Discord limit of 10 embeds
+                # Create embeds and files for all outputs. Discord allows 10
+                # embeds per message, so keep one for the overflow note.
+                total = self.output_count
+                shown = self.outputs if total <= MAX_EMBEDS else self.outputs[:MAX_EMBEDS - 1]
+                for i, output in enumerate(shown, start=1):
                     try:
-                        # Load and prepare image
-                        img = output.load_image()
-                        if img:
-                            img_buffer = io.BytesIO()
-                            img.save(img_buffer, format='PNG')
-                            img_buffer.seek(0)
-                            
-                            file = discord.File(img_buffer, filename=output.filename)
-                            files.append(file)
+                        # Attach the saved file as-is; it is already a valid image
+                        if os.path.exists(output.image_path):
+                            files.append(discord.File(output.image_path, filename=output.filename))
                             
+                            prompt = output.prompt if len(output.prompt) <= 100 else output.prompt[:100] + "..."
                             embed = discord.Embed(
-                                title=f"Final Output {i+1}/{len(self.outputs)} (Timed Out)",
-                                description=f"Prompt: {output.prompt[:100]}{'...' if len(output.prompt) > 100 else ''}",
+                                title=f"Final Output {i}/{total} (Timed Out)",
+                                description=f"Prompt: {prompt}",
                                 color=discord.Color.orange()
                             )
                             embed.set_image(url=f"attachment://{output.filename}")
                             embeds.append(embed)
                     except Exception as e:
-                        logger.error(f"Error preparing output {i}: {e}")
+                        logger.exception("Error preparing output %d: %s", i, e)
                         
-                # Add info about additional outputs if more than 10
-                if len(self.outputs) > 10:
+                # Add info about outputs that did not fit
+                hidden = total - len(shown)
+                if hidden:
                     info_embed = discord.Embed(
                         title="Additional Outputs",
-                        description=f"Note: {len(self.outputs) - 10} additional output images were generated but cannot be displayed due to Discord's 10-embed limit.",
+                        description=f"Note: {hidden} additional output images were generated but cannot be displayed due to Discord's 10-embed limit.",
                         color=discord.Color.blue()
                     )
                     embeds.insert(0, info_embed)
@@ -142,18 +220,23 @@ class ImageProcessingView(discord.ui.View):
             )
             
         except Exception as e:
-            logger.error(f"Error in timeout handler: {e}")
+            logger.exception("Error in timeout handler: %s", e)
+            # discord.py closes the files once they are sent, but these never were
+            for file in files:
+                file.close()
             try:
                 await self.message.edit(
                     content="🕒 Session timed out. An error occurred while displaying output images.",
                     view=None
                 )
-            except:
-                pass
+            except discord.HTTPException:
+                logger.exception("Failed to edit timed out message")
                 
     def add_output(self, output_image: OutputImage):
         """Add an output image to the session"""
-        self.outputs.append(output_image)
+        self.output_count += 1
+        if len(self.outputs) < MAX_EMBEDS:
+            self.outputs.append(output_image)
         
     @discord.ui.button(label='Process Image', style=discord.ButtonStyle.primary, emoji='🎨')
     async def process_button(self, interaction: discord.Interaction, button: discord.ui.Button):
@@ -174,7 +257,7 @@ class ImageProcessingView(discord.ui.View):
         # Show current outputs (simplified for now)
         embed = discord.Embed(
             title="Current Outputs",
-            description=f"Generated {len(self.outputs)} output image(s) so far.",
+            description=f"Generated {self.output_count} output image(s) so far.",
             color=discord.Color.blue()
         )
         await interaction.response.send_message(embed=embed, ephemeral=True)
@@ -184,7 +267,14 @@ class ImageModificationBot:
     
     def __init__(self):
         self.replicate_client = None
-        self.session = None
+        # Caps how many Replicate generations run at once
+        self.replicate_semaphore = asyncio.Semaphore(REPLICATE_CONCURRENCY)
+        # Time of each user's last accepted request, for the cooldown
+        self.user_last_request: Dict[int, float] = {}
+        # Replicate jobs currently running, keyed by image and prompt
+        self.inflight_requests: Dict[str, asyncio.Task] = {}
+        # Recently finished results, least recently used first
+        self.result_cache: "OrderedDict[str, Tuple[bytes, str]]" = OrderedDict()
         
     async def setup(self):
         """Initialize the bot components"""
@@ -199,99 +289,162 @@ class ImageModificationBot:
             logger.error("REPLICATE_API_TOKEN not found in environment variables")
             raise ValueError("Replicate API token is required")
         
-        # Set up Replicate client
-        os.environ['REPLICATE_API_TOKEN'] = REPLICATE_TOKEN
-        self.replicate_client = replicate
-        
-        # Create aiohttp session for downloading images
-        self.session = aiohttp.ClientSession()
+        # Set up Replicate client. The package is heavy, so it is only
+        # imported once the tokens are known to be present.
+        import replicate
+        self.replicate_client = replicate.Client(api_token=REPLICATE_TOKEN)
         
         logger.info("ImageModificationBot setup completed successfully")
     
-    async def cleanup(self):
-        """Clean up resources"""
-        if self.session:
-            await self.session.close()
-            logger.info("HTTP session closed")
-    
-    async def download_image(self, url: str, filename: str) -> Optional[str]:
-        """Download image from URL and save to local storage"""
+    async def download_image(self, attachment: discord.Attachment, filename: str) -> Optional[str]:
+        """Download an image attachment and save it to local storage"""
         try:
-            logger.info(f"Starting download of image from URL: {url}")
+            logger.info(f"Starting download of image from URL: {attachment.url}")
+            
+            # Fetch through discord.py's own HTTP session
+            data = await attachment.read()
+            
+            # Save it with a single write in a worker thread
+            file_path = os.fspath(INPUT_DIR / filename)
+            await asyncio.to_thread(write_image_file, file_path, data)
+            
+            logger.info(f"Successfully downloaded image to: {file_path}")
+            return file_path
             
-            async with self.session.get(url) as response:
-                if response.status != 200:
-                    logger.error(f"Failed to download image: HTTP {response.status}")
-                    return None
-                
-                # Check file size
-                content_length = response.headers.get('content-length')
-                if content_length and int(content_length) > MAX_FILE_SIZE_MB * 1024 * 1024:
-                    logger.error(f"Image too large: {content_length} bytes")
-                    return None
-                
-                # Save image
-                file_path = f"{IMAGES_FOLDER}/input/{filename}"
-                async with aiofiles.open(file_path, 'wb') as f:
-                    async for chunk in response.content.iter_chunked(8192):
-                        await f.write(chunk)
-                
-                logger.info(f"Successfully downloaded image to: {file_path}")
-                return file_path
-                
         except Exception as e:
-            logger.error(f"Error downloading image: {str(e)}")
+            logger.exception("Error downloading image: %s", e)
+            return None
+    
+    async def modify_image_with_replicate(self, image_url: str, prompt: str) -> Optional[Tuple[bytes, str, bool]]:
+        """Use Replicate API to modify the image at the given URL
+        
+        Returns the modified image data, the path it should be saved to, and
+        whether this call produced it. Identical requests made while one is
+        already running share its result, and recent results are answered from
+        memory; those are already saved by the request that produced them.
+        """
+        # Attachment URLs carry expiring signature parameters, so key on the
+        # path, which already identifies the attachment
+        key = hashlib.blake2b(f"{image_url.split('?')[0]}|{prompt}".encode(), digest_size=16).hexdigest()
+        cached = self.result_cache.get(key)
+        if cached is not None:
+            logger.info("Identical request already completed, reusing its result")
+            self.result_cache.move_to_end(key)
+            return (*cached, False)
+        
+        task = self.inflight_requests.get(key)
+        is_new = task is None
+        if is_new:
+            task = asyncio.create_task(self._run_modification(image_url, prompt))
+            self.inflight_requests[key] = task
+            task.add_done_callback(lambda _: self.inflight_requests.pop(key, None))
+        else:
+            logger.info("Identical request already in progress, sharing its result")
+        
+        # Shield the shared job so one requester being cancelled doesn't
+        # cancel it for the others
+        result = await asyncio.shield(task)
+        if result is None:
             return None
+        if is_new and RESULT_CACHE_SIZE > 0:
+            self.result_cache[key] = result
+            while len(self.result_cache) > RESULT_CACHE_SIZE:
+                self.result_cache.popitem(last=False)
+        return (*result, is_new)
     
-    async def modify_image_with_replicate(self, image_path: str, prompt: str) -> Optional[str]:
-        """Use Replicate API to modify the image"""
+    async def _run_modification(self, image_url: str, prompt: str) -> Optional[Tuple[bytes, str]]:
+        """Run a single Replicate modification job"""
         try:
             logger.info(f"Starting image modification with prompt: '{prompt}'")
-            logger.info(f"Using input image: {image_path}")
+            logger.info(f"Using input image: {image_url}")
+            
+            # Prepare input for Replicate. Discord CDN URLs are publicly
+            # fetchable, so Replicate pulls the image itself instead of us
+            # downloading and re-uploading the bytes.
+            input_data = {
+                "prompt": prompt,
+                "input_image": image_url,
+                "output_format": "jpg"
+            }
+            
+            logger.info("Sending request to Replicate API...")
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug("Input data: %s", json.dumps(input_data))
+            
+            # Call Replicate API through its async client, which polls the
+            # prediction without blocking the event loop and reuses one pooled
+            # HTTP connection for every request
+            output = await self.run_replicate(input_data)
+            
+            logger.info("Received response from Replicate API")
+            
+            # Generate output filename
+            output_filename = self.generate_filename("modified", "jpg")
+            output_path = os.fspath(OUTPUT_DIR / output_filename)
+            
+            # Fetch the output once; it is both uploaded and saved to disk
+            image_data = await output.aread()
+            
+            logger.info("Image modification completed successfully")
+            return image_data, output_path
             
-            # Prepare input for Replicate
-            with open(image_path, 'rb') as image_file:
-                input_data = {
-                    "prompt": prompt,
-                    "input_image": image_file,
-                    "output_format": "jpg"
-                }
-                
-                logger.info("Sending request to Replicate API...")
-                logger.debug(f"Input data: {json.dumps({k: v if k != 'input_image' else '<image_file>' for k, v in input_data.items()})}")
-                
-                # Call Replicate API
-                output = self.replicate_client.run(
-                    "black-forest-labs/flux-kontext-max",
-                    input=input_data
-                )
-                
-                logger.info("Received response from Replicate API")
-                
-                # Generate output filename
-                timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-                hash_suffix = hashlib.md5(prompt.encode()).hexdigest()[:8]
-                output_filename = f"modified_{timestamp}_{hash_suffix}.jpg"
-                output_path = f"{IMAGES_FOLDER}/output/{output_filename}"
-                
-                # Save output image
-                logger.info(f"Saving modified image to: {output_path}")
-                with open(output_path, "wb") as output_file:
-                    output_file.write(output.read())
-                
-                logger.info("Image modification completed successfully")
-                return output_path
-                
         except Exception as e:
-            logger.error(f"Error during image modification: {str(e)}")
-            logger.error(f"Error type: {type(e).__name__}")
+            logger.exception("Error during image modification (%s): %s", type(e).__name__, e)
             return None
     
-    def generate_filename(self, original_url: str, extension: str = "jpg") -> str:
+    async def run_replicate(self, input_data: Dict[str, Any]) -> Any:
+        """Run the model, backing off and retrying when Replicate throttles us"""
+        from replicate.exceptions import ReplicateError
+        
+        for attempt in range(REPLICATE_MAX_RETRIES + 1):
+            if self.replicate_semaphore.locked():
+                logger.info("Replicate concurrency limit reached, waiting for a free slot")
+            try:
+                async with self.replicate_semaphore:
+                    return await self.replicate_client.async_run(
+                        "black-forest-labs/flux-kontext-max",
+                        input=input_data
+                    )
+            except ReplicateError as e:
+                if e.status != 429 or attempt == REPLICATE_MAX_RETRIES:
+                    raise
+                # Wait as long as Replicate asks, else back off exponentially
+                match = THROTTLE_PATTERN.search(e.detail or "")
+                delay = float(match.group(1)) if match else 2 ** attempt
+                delay = min(delay, REPLICATE_MAX_BACKOFF)
+                logger.warning("Replicate throttled the request, retrying in %.1fs (attempt %d/%d)",
+                               delay, attempt + 1, REPLICATE_MAX_RETRIES)
+                await asyncio.sleep(delay)
+    
+    async def save_output_image(self, image_data: bytes, output_path: str) -> bool:
+        """Save a modified image to local storage"""
+        try:
+            logger.info(f"Saving modified image to: {output_path}")
+            await asyncio.to_thread(write_image_file, output_path, image_data)
+            return True
+        except Exception as e:
+            logger.exception("Error saving modified image: %s", e)
+            return False
+    
+    def check_user_cooldown(self, user_id: int) -> float:
+        """Return how many seconds a user must still wait, recording the request if allowed"""
+        now = time.monotonic()
+        # Entries are kept oldest first, so expired ones are dropped from the front
+        while self.user_last_request:
+            oldest = next(iter(self.user_last_request))
+            if now - self.user_last_request[oldest] < USER_COOLDOWN_SECONDS:
+                break
+            del self.user_last_request[oldest]
+        
+        last = self.user_last_request.get(user_id)
+        if last is not None:
+            return USER_COOLDOWN_SECONDS - (now - last)
+        self.user_last_request[user_id] = now
+        return 0.0
+    
+    def generate_filename(self, prefix: str = "input", extension: str = "jpg") -> str:
         """Generate a unique filename for the image"""
-        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-        url_hash = hashlib.md5(original_url.encode()).hexdigest()[:8]
-        return f"input_{timestamp}_{url_hash}.{extension}"
+        return f"{prefix}_{RUN_ID}_{next(FILE_COUNTER)}.{extension}"
 
 # Create bot instance
 image_bot = ImageModificationBot()
@@ -299,38 +452,34 @@ image_bot = ImageModificationBot()
 @bot.event
 async def on_ready():
     """Called when the bot is ready"""
-    logger.info(f"Bot logged in as {bot.user} (ID: {bot.user.id})")
-    logger.info(f"Bot is ready and connected to {len(bot.guilds)} guilds")
+    global BOT_MENTION_TOKENS
+    BOT_MENTION_TOKENS = (f"<@{bot.user.id}>", f"<@!{bot.user.id}>")
+    logger.info("Bot logged in as %s (ID: %s), connected to %d guilds",
+                bot.user, bot.user.id, len(bot.guilds))
     
-    # Setup the image bot
-    await image_bot.setup()
+    # Setup the image bot. on_ready fires again after every reconnect, so
+    # skip the one-time setup once it has been done.
+    if image_bot.replicate_client is None:
+        await image_bot.setup()
     
     # Log configuration
-    logger.info(f"Images folder: {IMAGES_FOLDER}")
-    logger.info(f"Max file size: {MAX_FILE_SIZE_MB}MB")
-    if ALLOWED_CHANNEL_ID:
-        logger.info(f"Restricted to channel ID: {ALLOWED_CHANNEL_ID}")
-    else:
-        logger.info("Bot will work in all channels")
+    logger.info("Images folder: %s, max file size: %dMB, channel: %s",
+                IMAGES_FOLDER, MAX_FILE_SIZE_MB, ALLOWED_CHANNEL_ID or "all channels")
 
 @bot.event
 async def on_message(message):
     """Handle incoming messages"""
-    # Ignore messages from the bot itself
-    if message.author == bot.user:
+    # Ignore messages from bots, including ourselves
+    if message.author.bot:
         return
     
     # Log all messages for debugging
-    logger.debug(f"Message from {message.author}: {message.content}")
+    logger.debug("Message from %s: %s", message.author, message.content)
     
-    # Check if this is a reply to a message
-    if not message.reference:
-        logger.debug("Message is not a reply, ignoring")
-        return
-    
-    # Check if bot is mentioned in the message
-    if bot.user not in message.mentions:
-        logger.debug("Bot not mentioned in message, ignoring")
+    # Fast path: only replies that mention the bot are image requests, so
+    # everything else just goes through normal command handling
+    if message.reference is None or not any(m.id == bot.user.id for m in message.mentions):
+        await bot.process_commands(message)
         return
     
     # Check channel restrictions
@@ -338,31 +487,43 @@ async def on_message(message):
         logger.info(f"Message from restricted channel {message.channel.id}, ignoring")
         return
     
+    # Shed load instead of queueing requests without bound during bursts
+    if HANDLER_SEMAPHORE.locked():
+        logger.info("Too many requests in flight, turning away %s", message.author)
+        await message.reply("I'm busy with other images right now. Please try again in a moment.")
+        return
+    
     logger.info(f"Processing message from {message.author} in channel {message.channel.name}")
     
+    await HANDLER_SEMAPHORE.acquire()
     try:
-        # Get the replied-to message
-        replied_message = await message.channel.fetch_message(message.reference.message_id)
+        # Get the replied-to message, using the copy the gateway usually
+        # delivers with the reply before falling back to an API fetch
+        replied_message = message.reference.resolved
+        if not isinstance(replied_message, discord.Message):
+            replied_message = await message.channel.fetch_message(message.reference.message_id)
         logger.info(f"Found replied message from {replied_message.author}")
         
-        # Check if the replied message has attachments (images)
-        image_attachments = [att for att in replied_message.attachments 
-                           if att.content_type and att.content_type.startswith('image/')]
+        # Get the first image attachment from the replied message
+        image_attachment = next(
+            (att for att in replied_message.attachments if is_image_attachment(att)), None
+        )
         
-        if not image_attachments:
+        if image_attachment is None:
             logger.info("No image attachments found in replied message")
             await message.reply("I need an image to modify. Please reply to a message that contains an image.")
             return
         
-        # Get the first image attachment
-        image_attachment = image_attachments[0]
         logger.info(f"Found image attachment: {image_attachment.filename} ({image_attachment.size} bytes)")
         
-        # Extract the prompt from the message (remove bot mention)
-        prompt = message.content
-        for mention in message.mentions:
-            prompt = prompt.replace(f"<@{mention.id}>", "").replace(f"<@!{mention.id}>", "")
-        prompt = prompt.strip()
+        # Reject oversized images up front; Discord already tells us the size
+        if image_attachment.size > MAX_FILE_SIZE_MB * 1024 * 1024:
+            logger.info("Image too large: %d bytes", image_attachment.size)
+            await message.reply(f"That image is too large. The maximum file size is {MAX_FILE_SIZE_MB}MB.")
+            return
+        
+        # Extract the prompt from the message (remove mentions)
+        prompt = extract_prompt(message.content)
         
         if not prompt:
             logger.info("No prompt provided in message")
@@ -371,35 +532,52 @@ async def on_message(message):
         
         logger.info(f"Using prompt: '{prompt}'")
         
+        # Rate limit each user so spammed mentions don't queue up Replicate
+        # jobs. Only valid requests count, so a user can fix a rejected one
+        # and retry straight away.
+        wait = image_bot.check_user_cooldown(message.author.id)
+        if wait > 0:
+            logger.info("User %s is on cooldown for %.1fs, ignoring", message.author, wait)
+            await message.reply(f"Please wait {math.ceil(wait)} more seconds before your next request.")
+            return
+        
         # Send initial response
         processing_message = await message.reply("Processing your image modification request...")
         
-        # Download the image
-        filename = image_bot.generate_filename(image_attachment.url, 
-                                             image_attachment.filename.split('.')[-1])
-        logger.info(f"Downloading image as: {filename}")
-        
-        image_path = await image_bot.download_image(image_attachment.url, filename)
-        if not image_path:
-            logger.error("Failed to download image")
-            await processing_message.edit(content="Failed to download the image. Please try again.")
-            return
-        
         # Modify the image using Replicate
         logger.info("Starting image modification...")
-        modified_image_path = await image_bot.modify_image_with_replicate(image_path, prompt)
+        modification = image_bot.modify_image_with_replicate(image_attachment.url, prompt)
+        
+        # Replicate fetches the image straight from the Discord CDN, so
+        # archiving a local copy (if enabled) runs alongside it
+        if ARCHIVE_INPUTS:
+            extension = os.path.splitext(image_attachment.filename)[1][1:] or "jpg"
+            filename = image_bot.generate_filename("input", extension)
+            logger.info(f"Downloading image as: {filename}")
+            
+            image_path, result = await asyncio.gather(
+                image_bot.download_image(image_attachment, filename),
+                modification
+            )
+            if not image_path:
+                logger.warning("Failed to archive input image")
+        else:
+            result = await modification
         
-        if not modified_image_path:
+        if not result:
             logger.error("Failed to modify image")
             await processing_message.edit(content="Failed to modify the image. Please try again later.")
             return
         
+        modified_image_data, modified_image_path, is_new = result
+        
         # Send the modified image back
         logger.info(f"Sending modified image: {modified_image_path}")
         
         # Create an OutputImage object
         output_filename = f"modified_{image_attachment.filename}"
         output_image = OutputImage(modified_image_path, prompt, output_filename)
+        file = discord.File(io.BytesIO(modified_image_data), filename=output_filename)
         
         # Check if we should use interactive mode (for demonstration of timeout feature)
         # For now, we'll use the simple mode but include the infrastructure
@@ -416,26 +594,33 @@ async def on_message(message):
                 description=f"Generated image with prompt: '{prompt}'",
                 color=discord.Color.green()
             )
+            embed.set_image(url=f"attachment://{output_filename}")
             
-            with open(modified_image_path, 'rb') as modified_file:
-                file = discord.File(modified_file, filename=output_filename)
-                embed.set_image(url=f"attachment://{output_filename}")
-                
-                view_message = await processing_message.edit(
-                    content="✅ **Image processed!** Use the buttons below to interact:",
-                    embed=embed,
-                    attachments=[file],
-                    view=view
-                )
-                view.message = view_message
+            send_result = processing_message.edit(
+                content="✅ **Image processed!** Use the buttons below to interact:",
+                embed=embed,
+                attachments=[file],
+                view=view
+            )
         else:
             # Use the original simple mode
-            with open(modified_image_path, 'rb') as modified_file:
-                file = discord.File(modified_file, filename=output_filename)
-                await processing_message.edit(
-                    content=f"Here's your modified image with prompt: '{prompt}'",
-                    attachments=[file]
-                )
+            send_result = processing_message.edit(
+                content=f"Here's your modified image with prompt: '{prompt}'",
+                attachments=[file]
+            )
+        
+        # Save a new output to disk while it uploads to Discord. A shared or
+        # cached result was saved by the request that produced it, and
+        # rewriting it could truncate the file while a timed-out view attaches it.
+        if is_new:
+            _, result_message = await asyncio.gather(
+                image_bot.save_output_image(modified_image_data, modified_image_path),
+                send_result
+            )
+        else:
+            result_message = await send_result
+        if use_interactive:
+            view.message = result_message
         
         logger.info("Image modification request completed successfully")
         
@@ -446,14 +631,15 @@ async def on_message(message):
         logger.error("Bot lacks permissions to access the message")
         await message.reply("I don't have permission to access that message.")
     except Exception as e:
-        logger.error(f"Unexpected error processing message: {str(e)}")
-        logger.error(f"Error type: {type(e).__name__}")
+        logger.exception("Unexpected error processing message (%s): %s", type(e).__name__, e)
         await message.reply("An unexpected error occurred. Please try again later.")
+    finally:
+        HANDLER_SEMAPHORE.release()
 
 @bot.event
 async def on_error(event, *args, **kwargs):
     """Handle bot errors"""
-    logger.error(f"An error occurred in event {event}: {args}")
+    logger.exception("An error occurred in event %s: %s", event, args)
 
 @bot.command(name='bothelp')
 async def help_command(ctx):
@@ -479,7 +665,7 @@ Add the word "interactive" to your prompt to use the new interactive mode with t
 • `!status` - Show bot status and configuration
 
 The bot will download the image, process it using AI, and send back the modified version.
-Both input and output images are saved for storage.
+Output images are saved for storage (input images too when ARCHIVE_INPUTS is enabled).
 
 **Interactive Sessions:**
 - Interactive sessions timeout after 30 minutes
@@ -500,12 +686,14 @@ async def test_timeout_command(ctx):
     # Create some sample output images for demonstration
     try:
         # Create a sample image in memory
+        from PIL import Image
         sample_img = Image.new('RGB', (100, 100), color='red')
         
         # Save to temporary location
-        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-        sample_path = f"{IMAGES_FOLDER}/output/sample_{timestamp}.png"
-        sample_img.save(sample_path)
+        timestamp = time.strftime("%Y%m%d_%H%M%S")
+        sample_path = os.fspath(OUTPUT_DIR / f"sample_{timestamp}.png")
+        await asyncio.to_thread(OUTPUT_DIR.mkdir, parents=True, exist_ok=True)
+        await asyncio.to_thread(sample_img.save, sample_path)
         
         # Create OutputImage objects
         output1 = OutputImage(sample_path, "Sample prompt 1", f"sample1_{timestamp}.png")
@@ -533,7 +721,7 @@ async def test_timeout_command(ctx):
         logger.info("Test timeout session created successfully")
         
     except Exception as e:
-        logger.error(f"Error creating test timeout session: {e}")
+        logger.exception("Error creating test timeout session: %s", e)
         await ctx.send("Error creating test session. Please check the logs.")
 
 @bot.command(name='status')
@@ -558,16 +746,17 @@ async def main():
     except KeyboardInterrupt:
         logger.info("Bot stopped by user")
     except Exception as e:
-        logger.error(f"Error starting bot: {str(e)}")
+        logger.exception("Error starting bot: %s", e)
     finally:
-        await image_bot.cleanup()
         await bot.close()
 
 if __name__ == "__main__":
     try:
-        asyncio.run(main())
+        # Prefer uvloop's faster event loop where it is installed
+        run = uvloop.run if uvloop else asyncio.run
+        run(main())
     except KeyboardInterrupt:
         logger.info("Bot shutdown requested")
     except Exception as e:
-        logger.error(f"Fatal error: {str(e)}")
+        logger.exception("Fatal error: %s", e)
         sys.exit(1)
\ No newline at end of file
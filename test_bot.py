@@ -1,185 +1,475 @@
 #!/usr/bin/env python3
 """
-Test script for Discord bot functionality without requiring tokens or running the actual bot.
-This script validates the core logic and configuration.
+Tests for Discord bot functionality without requiring tokens or running the actual bot.
+These validate the core logic and configuration. Run them with pytest.
 """
 
+import asyncio
+import json
 import os
+import re
+import subprocess
 import sys
-import tempfile
-import hashlib
-from datetime import datetime
-from pathlib import Path
+from types import SimpleNamespace
+from unittest.mock import AsyncMock, MagicMock
 
-# Add current directory to path
-sys.path.insert(0, '.')
+import discord
+import pytest
+
+import discord_bot
+from discord_bot import ImageModificationBot, is_image_attachment, extract_prompt, IMAGE_EXTENSIONS, RUN_ID
+
+# Image directories the repo ships with
+IMAGES_FOLDER = "./images"
+INPUT_DIR = f"{IMAGES_FOLDER}/input"
+OUTPUT_DIR = f"{IMAGES_FOLDER}/output"
+
+# (content type, filename, is an image); the filename is only used when
+# Discord sends no content type
+ATTACHMENT_CASES = (
+    (None, "photo.PNG", True),
+    (None, "photo.jpeg", True),
+    (None, "anim.webp", True),
+    (None, "notes.txt", False),
+    ("image/png", "upload", True),
+    ("application/pdf", "scan.png", False),
+)
+
+# (message content, expected prompt)
+MENTION_CASES = (
+    ("<@123456789> make it blue", "make it blue"),
+    ("<@!123456789> make it blue", "make it blue"),
+    ("make <@123456789> it blue", "make  it blue"),
+    ("<@123456789> <@987654321> add a hat", "add a hat"),
+    ("<@123456789>", ""),
+)
+
+# ID of the bot's own user in the fake messages below
+BOT_USER_ID = 42
 
 def test_filename_generation():
     """Test the filename generation logic"""
-    print("Testing filename generation...")
-    
-    # Simulate the filename generation from the bot
-    def generate_filename(original_url: str, extension: str = "jpg") -> str:
-        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-        url_hash = hashlib.md5(original_url.encode()).hexdigest()[:8]
-        return f"input_{timestamp}_{url_hash}.{extension}"
+    # The bot's run ID holds the timestamp, formatted once at import
+    image_bot = ImageModificationBot()
+    filename = image_bot.generate_filename("input", "png")
     
-    test_url = "https://example.com/image.png"
-    filename = generate_filename(test_url, "png")
-    
-    print(f"  Generated filename: {filename}")
+    assert filename != image_bot.generate_filename("input", "png"), "Filenames should not repeat"
     
     # Validate filename format
-    parts = filename.split('_')
-    if len(parts) >= 3 and filename.startswith('input_'):
-        print("✓ Filename generation working correctly")
-        return True
-    else:
-        print("✗ Filename generation failed")
-        return False
+    assert filename.startswith(f"input_{RUN_ID}_") and filename.endswith(".png"), f"Unexpected filename: {filename}"
 
 def test_directory_structure():
     """Test directory creation and structure"""
-    print("Testing directory structure...")
-    
-    images_folder = "./images"
-    input_dir = f"{images_folder}/input"
-    output_dir = f"{images_folder}/output"
-    
     # Check if directories exist
-    if Path(input_dir).exists() and Path(output_dir).exists():
-        print("✓ Image directories exist")
-        
-        # Check for .gitkeep files
-        if Path(f"{input_dir}/.gitkeep").exists() and Path(f"{output_dir}/.gitkeep").exists():
-            print("✓ .gitkeep files present")
-            return True
-        else:
-            print("○ .gitkeep files missing (optional)")
-            return True
-    else:
-        print("✗ Image directories missing")
-        return False
+    assert os.path.exists(INPUT_DIR) and os.path.exists(OUTPUT_DIR), "Image directories missing"
+    
+    # Check for .gitkeep files
+    assert os.path.exists(f"{INPUT_DIR}/.gitkeep"), ".gitkeep missing from input directory"
+    assert os.path.exists(f"{OUTPUT_DIR}/.gitkeep"), ".gitkeep missing from output directory"
 
 def test_environment_example():
     """Test environment configuration"""
-    print("Testing environment configuration...")
-    
     env_example_path = ".env.example"
-    if Path(env_example_path).exists():
-        with open(env_example_path, 'r') as f:
-            content = f.read()
-            
-        required_vars = [
-            'DISCORD_BOT_TOKEN',
-            'REPLICATE_API_TOKEN',
-            'IMAGES_FOLDER',
-            'MAX_FILE_SIZE_MB'
-        ]
-        
-        missing_vars = []
-        for var in required_vars:
-            if var not in content:
-                missing_vars.append(var)
-        
-        if not missing_vars:
-            print("✓ All required environment variables documented")
-            return True
-        else:
-            print(f"✗ Missing environment variables: {missing_vars}")
-            return False
-    else:
-        print("✗ .env.example file missing")
-        return False
+    try:
+        with open(env_example_path, 'rb') as f:
+            content = f.read().decode('utf-8')
+    except FileNotFoundError:
+        pytest.fail(".env.example file missing")
+    
+    required_vars = [
+        'DISCORD_BOT_TOKEN',
+        'REPLICATE_API_TOKEN',
+        'IMAGES_FOLDER',
+        'MAX_FILE_SIZE_MB'
+    ]
+    
+    # Collect the variable names defined in the file in one pass
+    defined_vars = {
+        line.split('=', 1)[0].strip()
+        for line in content.splitlines()
+        if line.strip() and not line.lstrip().startswith('#')
+    }
+    missing_vars = [var for var in required_vars if var not in defined_vars]
+    
+    assert not missing_vars, f"Missing environment variables: {missing_vars}"
 
 def test_requirements():
     """Test requirements.txt"""
-    print("Testing requirements.txt...")
-    
     requirements_path = "requirements.txt"
-    if Path(requirements_path).exists():
-        with open(requirements_path, 'r') as f:
-            content = f.read()
-            
-        required_packages = [
-            'discord.py',
-            'replicate',
-            'python-dotenv',
-            'aiohttp',
-            'aiofiles'
-        ]
-        
-        missing_packages = []
-        for package in required_packages:
-            if package not in content:
-                missing_packages.append(package)
-        
-        if not missing_packages:
-            print("✓ All required packages listed")
-            return True
-        else:
-            print(f"✗ Missing packages: {missing_packages}")
-            return False
-    else:
-        print("✗ requirements.txt missing")
-        return False
-
-def test_bot_configuration():
-    """Test bot configuration logic"""
-    print("Testing bot configuration...")
-    
-    # Test default values
-    default_images_folder = "./images"
-    default_max_size = 25
-    
-    # Simulate environment variable reading
-    images_folder = os.getenv('IMAGES_FOLDER', default_images_folder)
-    max_file_size = int(os.getenv('MAX_FILE_SIZE_MB', str(default_max_size)))
-    
-    if images_folder == default_images_folder and max_file_size == default_max_size:
-        print("✓ Default configuration values working")
-        return True
-    else:
-        print("✗ Configuration logic failed")
-        return False
-
-def main():
-    """Run all tests"""
-    print("Running Discord Bot Tests...")
-    print("=" * 50)
-    
-    tests = [
-        test_filename_generation,
-        test_directory_structure,
-        test_environment_example,
-        test_requirements,
-        test_bot_configuration
+    try:
+        with open(requirements_path, 'rb') as f:
+            content = f.read().decode('utf-8')
+    except FileNotFoundError:
+        pytest.fail("requirements.txt missing")
+    
+    required_packages = [
+        'discord.py',
+        'replicate',
+        'python-dotenv',
+        'aiohttp'
     ]
     
-    passed = 0
-    failed = 0
-    
-    for test in tests:
-        try:
-            if test():
-                passed += 1
-            else:
-                failed += 1
-        except Exception as e:
-            print(f"✗ Test {test.__name__} crashed: {e}")
-            failed += 1
-        print()
-    
-    print("=" * 50)
-    print(f"Test Results: {passed} passed, {failed} failed")
-    
-    if failed == 0:
-        print("✓ All tests passed! Bot setup is correct.")
-        return True
-    else:
-        print("✗ Some tests failed. Please check the issues above.")
-        return False
+    # Collect the package names, without version specifiers or markers
+    listed_packages = {
+        re.split(r'[<>=!~;\[\s]', line.strip(), maxsplit=1)[0].lower()
+        for line in content.splitlines()
+        if line.strip() and not line.lstrip().startswith('#')
+    }
+    missing_packages = [package for package in required_packages if package not in listed_packages]
+    
+    assert not missing_packages, f"Missing packages: {missing_packages}"
+
+@pytest.mark.parametrize("content_type, filename, expected", ATTACHMENT_CASES)
+def test_image_attachment_detection(content_type, filename, expected):
+    """Test image attachment detection"""
+    attachment = SimpleNamespace(content_type=content_type, filename=filename)
+    assert is_image_attachment(attachment) == expected, f"Wrong result for {filename} ({content_type})"
+
+@pytest.mark.parametrize("ext", IMAGE_EXTENSIONS)
+def test_image_extension_detection(ext):
+    """Test every accepted extension is recognised, whatever its case"""
+    for filename in (f"test{ext}", f"test{ext.upper()}"):
+        attachment = SimpleNamespace(content_type=None, filename=filename)
+        assert is_image_attachment(attachment), f"{filename} should be detected as an image"
+
+@pytest.mark.parametrize("original, expected", MENTION_CASES)
+def test_mention_parsing(original, expected):
+    """Test prompt extraction from mentions"""
+    result = extract_prompt(original)
+    assert result == expected, f"Got {result!r} from {original!r}, expected {expected!r}"
+
+def test_user_cooldown(monkeypatch):
+    """Test a user is blocked during the cooldown window and allowed after it"""
+    now = [1000.0]
+    monkeypatch.setattr(discord_bot.time, "monotonic", lambda: now[0])
+    monkeypatch.setattr(discord_bot, "USER_COOLDOWN_SECONDS", 10.0)
+    
+    image_bot = ImageModificationBot()
+    assert image_bot.check_user_cooldown(1) == 0.0, "First request should be allowed"
+    
+    now[0] += 4.0
+    assert image_bot.check_user_cooldown(1) == pytest.approx(6.0), "Request inside the window should wait"
+    assert image_bot.check_user_cooldown(2) == 0.0, "Other users should not be affected"
+    
+    now[0] += 6.0
+    assert image_bot.check_user_cooldown(1) == 0.0, "Request after the window should be allowed"
+    assert list(image_bot.user_last_request) == [2, 1], "Expired entries should be dropped"
+    
+    now[0] += 10.0
+    assert image_bot.check_user_cooldown(3) == 0.0
+    assert list(image_bot.user_last_request) == [3], "Expired entries should be dropped"
+
+def stub_modification(monkeypatch, image_bot, results=None):
+    """Replace the Replicate job with a stub, returning the list of its calls"""
+    calls = []
+    
+    async def run_modification(image_url, prompt):
+        calls.append((image_url, prompt))
+        if results is not None:
+            return results.pop(0)
+        return f"{prompt}-data".encode(), f"{prompt}.jpg"
+    
+    monkeypatch.setattr(image_bot, "_run_modification", run_modification)
+    return calls
+
+async def test_identical_requests_share_one_job(monkeypatch):
+    """Test concurrent requests for the same attachment and prompt run one job"""
+    image_bot = ImageModificationBot()
+    release = asyncio.Event()
+    calls = []
+    
+    async def run_modification(image_url, prompt):
+        calls.append(image_url)
+        await release.wait()
+        return b"data", "out.jpg"
+    
+    monkeypatch.setattr(image_bot, "_run_modification", run_modification)
+    
+    # Attachment URLs differ only in their expiring signature parameters
+    first = asyncio.create_task(image_bot.modify_image_with_replicate(
+        "https://cdn.discordapp.com/attachments/1/2/a.png?ex=1&hm=a", "make it blue"))
+    second = asyncio.create_task(image_bot.modify_image_with_replicate(
+        "https://cdn.discordapp.com/attachments/1/2/a.png?ex=2&hm=b", "make it blue"))
+    await asyncio.sleep(0)
+    release.set()
+    
+    results = await asyncio.gather(first, second)
+    assert len(calls) == 1, "Identical requests should share one job"
+    assert results == [(b"data", "out.jpg", True), (b"data", "out.jpg", False)]
+    assert not image_bot.inflight_requests, "Finished jobs should be removed"
+
+async def test_cancelled_waiter_keeps_shared_job(monkeypatch):
+    """Test cancelling one requester does not cancel the job others wait on"""
+    image_bot = ImageModificationBot()
+    release = asyncio.Event()
+    
+    async def run_modification(image_url, prompt):
+        await release.wait()
+        return b"data", "out.jpg"
+    
+    monkeypatch.setattr(image_bot, "_run_modification", run_modification)
+    
+    url = "https://cdn.discordapp.com/attachments/1/2/a.png"
+    first = asyncio.create_task(image_bot.modify_image_with_replicate(url, "make it blue"))
+    second = asyncio.create_task(image_bot.modify_image_with_replicate(url, "make it blue"))
+    await asyncio.sleep(0)
+    
+    first.cancel()
+    with pytest.raises(asyncio.CancelledError):
+        await first
+    release.set()
+    
+    assert await second == (b"data", "out.jpg", False), "Other requesters should still get the result"
+    assert not image_bot.inflight_requests, "Finished jobs should be removed"
+
+async def test_result_cache(monkeypatch):
+    """Test repeated requests are answered from the cache and the oldest is evicted"""
+    monkeypatch.setattr(discord_bot, "RESULT_CACHE_SIZE", 2)
+    image_bot = ImageModificationBot()
+    calls = stub_modification(monkeypatch, image_bot)
+    url = "https://cdn.discordapp.com/attachments/1/2/a.png"
+    
+    assert await image_bot.modify_image_with_replicate(url, "one") == (b"one-data", "one.jpg", True)
+    assert await image_bot.modify_image_with_replicate(url, "one") == (b"one-data", "one.jpg", False)
+    assert len(calls) == 1, "A cached result should not run the job again"
+    
+    # "one" was used last, so "two" is the one evicted by "three"
+    await image_bot.modify_image_with_replicate(url, "two")
+    await image_bot.modify_image_with_replicate(url, "one")
+    await image_bot.modify_image_with_replicate(url, "three")
+    assert len(image_bot.result_cache) == 2, "Cache should stay within its size"
+    
+    await image_bot.modify_image_with_replicate(url, "one")
+    await image_bot.modify_image_with_replicate(url, "two")
+    assert [prompt for _, prompt in calls] == ["one", "two", "three", "two"]
+
+async def test_result_cache_skips_failures(monkeypatch):
+    """Test failed jobs are not cached, so the next request retries"""
+    monkeypatch.setattr(discord_bot, "RESULT_CACHE_SIZE", 2)
+    image_bot = ImageModificationBot()
+    calls = stub_modification(monkeypatch, image_bot, [None, (b"data", "out.jpg")])
+    url = "https://cdn.discordapp.com/attachments/1/2/a.png"
+    
+    assert await image_bot.modify_image_with_replicate(url, "retry") is None
+    assert not image_bot.result_cache, "Failures should not be cached"
+    assert await image_bot.modify_image_with_replicate(url, "retry") == (b"data", "out.jpg", True)
+    assert len(calls) == 2, "The request after a failure should run the job again"
+
+async def test_result_cache_disabled(monkeypatch):
+    """Test nothing is cached by default, so every request is a new variation"""
+    monkeypatch.setattr(discord_bot, "RESULT_CACHE_SIZE", 0)
+    image_bot = ImageModificationBot()
+    calls = stub_modification(monkeypatch, image_bot)
+    url = "https://cdn.discordapp.com/attachments/1/2/a.png"
+    
+    await image_bot.modify_image_with_replicate(url, "again")
+    assert await image_bot.modify_image_with_replicate(url, "again") == (b"again-data", "again.jpg", True)
+    assert len(calls) == 2, "Every request should run the job when caching is off"
+
+class FakeReplicateClient:
+    """Replicate client stub whose async_run raises the given errors, then succeeds"""
+    
+    def __init__(self, errors):
+        self.errors = list(errors)
+        self.calls = 0
+    
+    async def async_run(self, model, input):
+        self.calls += 1
+        if self.errors:
+            raise self.errors.pop(0)
+        return "output"
+
+async def test_replicate_retries_when_throttled():
+    """Test throttled requests are retried after the wait Replicate asks for"""
+    from replicate.exceptions import ReplicateError
+    
+    image_bot = ImageModificationBot()
+    image_bot.replicate_client = FakeReplicateClient([
+        ReplicateError(status=429, detail="Request was throttled. Expected available in 0.01 seconds.")
+    ])
+    
+    assert await image_bot.run_replicate({"prompt": "make it blue"}) == "output"
+    assert image_bot.replicate_client.calls == 2, "Throttled request should be retried once"
+
+async def test_replicate_gives_up_after_retries(monkeypatch):
+    """Test throttling past the retry limit is re-raised"""
+    from replicate.exceptions import ReplicateError
+    
+    monkeypatch.setattr(discord_bot, "REPLICATE_MAX_RETRIES", 2)
+    throttled = ReplicateError(status=429, detail="Expected available in 0.01 seconds.")
+    image_bot = ImageModificationBot()
+    image_bot.replicate_client = FakeReplicateClient([throttled] * 3)
+    
+    with pytest.raises(ReplicateError):
+        await image_bot.run_replicate({"prompt": "make it blue"})
+    assert image_bot.replicate_client.calls == 3, "Should try once plus each retry"
+
+async def test_replicate_without_retries(monkeypatch):
+    """Test a throttled request is re-raised after one attempt when retries are off"""
+    from replicate.exceptions import ReplicateError
+    
+    monkeypatch.setattr(discord_bot, "REPLICATE_MAX_RETRIES", 0)
+    image_bot = ImageModificationBot()
+    image_bot.replicate_client = FakeReplicateClient([ReplicateError(status=429, detail="Throttled")])
+    
+    with pytest.raises(ReplicateError):
+        await image_bot.run_replicate({"prompt": "make it blue"})
+    assert image_bot.replicate_client.calls == 1, "Should try exactly once"
+
+async def test_replicate_other_errors_not_retried():
+    """Test errors other than throttling are re-raised straight away"""
+    from replicate.exceptions import ReplicateError
+    
+    image_bot = ImageModificationBot()
+    image_bot.replicate_client = FakeReplicateClient([ReplicateError(status=422, detail="Invalid input")])
+    
+    with pytest.raises(ReplicateError):
+        await image_bot.run_replicate({"prompt": "make it blue"})
+    assert image_bot.replicate_client.calls == 1, "Non-throttling errors should not be retried"
+
+@pytest.mark.parametrize("missing", ["DISCORD_TOKEN", "REPLICATE_TOKEN"])
+async def test_setup_requires_tokens(monkeypatch, missing):
+    """Test setup refuses to start without both API tokens"""
+    monkeypatch.setattr(discord_bot, "DISCORD_TOKEN", "discord-token")
+    monkeypatch.setattr(discord_bot, "REPLICATE_TOKEN", "replicate-token")
+    monkeypatch.setattr(discord_bot, missing, None)
+    
+    image_bot = ImageModificationBot()
+    with pytest.raises(ValueError, match="token is required"):
+        await image_bot.setup()
+    assert image_bot.replicate_client is None, "No client should be created without tokens"
+
+async def test_save_creates_missing_directory(tmp_path):
+    """Test saving works before setup has run, when the directory does not exist yet"""
+    output_path = tmp_path / "images" / "output" / "out.jpg"
+    
+    image_bot = ImageModificationBot()
+    assert await image_bot.save_output_image(b"data", str(output_path)), "Save should succeed"
+    assert output_path.read_bytes() == b"data"
+
+def make_request(user_id=7, size=1024):
+    """Build a fake reply to an image message that mentions the bot"""
+    attachment = SimpleNamespace(
+        content_type="image/png", filename="photo.png", size=size,
+        url="https://cdn.discordapp.com/attachments/1/2/photo.png"
+    )
+    replied_message = MagicMock(spec=discord.Message)
+    replied_message.attachments = [attachment]
+    
+    message = MagicMock()
+    message.author = SimpleNamespace(bot=False, id=user_id)
+    message.content = f"<@{BOT_USER_ID}> make it blue"
+    message.mentions = [SimpleNamespace(id=BOT_USER_ID)]
+    message.reference = SimpleNamespace(resolved=replied_message, message_id=1)
+    message.channel = SimpleNamespace(id=5, name="images")
+    message.reply = AsyncMock(return_value=AsyncMock())
+    return message
+
+@pytest.fixture
+def request_bot(monkeypatch):
+    """Set up on_message with a fresh ImageModificationBot whose Replicate and disk work are stubbed"""
+    monkeypatch.setattr(discord_bot.bot._connection, "user", SimpleNamespace(id=BOT_USER_ID))
+    monkeypatch.setattr(discord_bot, "ALLOWED_CHANNEL_ID", None)
+    monkeypatch.setattr(discord_bot, "ARCHIVE_INPUTS", False)
+    monkeypatch.setattr(discord_bot, "HANDLER_SEMAPHORE", asyncio.BoundedSemaphore(1))
+    
+    image_bot = ImageModificationBot()
+    image_bot.modify_image_with_replicate = AsyncMock(return_value=(b"data", "out.jpg", True))
+    image_bot.save_output_image = AsyncMock(return_value=True)
+    monkeypatch.setattr(discord_bot, "image_bot", image_bot)
+    return image_bot
+
+async def test_busy_reply_when_handlers_full(request_bot):
+    """Test requests beyond MAX_INFLIGHT are turned away instead of queued"""
+    started = asyncio.Event()
+    release = asyncio.Event()
+    
+    async def modify(image_url, prompt):
+        started.set()
+        await release.wait()
+        return b"data", "out.jpg", True
+    
+    request_bot.modify_image_with_replicate = modify
+    
+    first = make_request(user_id=1)
+    handler = asyncio.create_task(discord_bot.on_message(first))
+    await asyncio.wait_for(started.wait(), timeout=1)
+    
+    # Time out rather than hang if the second request queues for the slot
+    second = make_request(user_id=2)
+    await asyncio.wait_for(discord_bot.on_message(second), timeout=1)
+    second.reply.assert_awaited_once()
+    assert "busy" in second.reply.await_args.args[0], "Second request should be told the bot is busy"
+    
+    release.set()
+    await asyncio.wait_for(handler, timeout=1)
+    first.reply.return_value.edit.assert_awaited_once()
+    assert not discord_bot.HANDLER_SEMAPHORE.locked(), "Handler slot should be released"
+
+async def test_handler_slot_released_on_error(request_bot):
+    """Test the handler slot is released when processing fails"""
+    request_bot.modify_image_with_replicate = AsyncMock(side_effect=RuntimeError("boom"))
+    
+    message = make_request()
+    await discord_bot.on_message(message)
+    
+    assert "unexpected error" in message.reply.await_args.args[0], "User should be told about the error"
+    assert not discord_bot.HANDLER_SEMAPHORE.locked(), "Handler slot should be released"
+
+async def test_oversized_image_rejected(request_bot):
+    """Test images over MAX_FILE_SIZE_MB are rejected before any Replicate work"""
+    message = make_request(size=discord_bot.MAX_FILE_SIZE_MB * 1024 * 1024 + 1)
+    await discord_bot.on_message(message)
+    
+    message.reply.assert_awaited_once()
+    assert "too large" in message.reply.await_args.args[0], "User should be told the image is too large"
+    request_bot.modify_image_with_replicate.assert_not_called()
+
+@pytest.mark.parametrize("is_new", [True, False])
+async def test_output_saved_only_when_new(request_bot, is_new):
+    """Test shared or cached results are not saved again"""
+    request_bot.modify_image_with_replicate.return_value = (b"data", "out.jpg", is_new)
+    
+    message = make_request()
+    await discord_bot.on_message(message)
+    
+    message.reply.return_value.edit.assert_awaited_once()
+    assert request_bot.save_output_image.await_count == int(is_new), "Only new results should be saved"
+
+async def test_cooldown_reply_rounds_up(request_bot, monkeypatch):
+    """Test the cooldown reply never tells a user to wait 0 seconds"""
+    monkeypatch.setattr(discord_bot, "USER_COOLDOWN_SECONDS", 10.0)
+    request_bot.user_last_request[7] = discord_bot.time.monotonic() - 9.7
+    
+    message = make_request(user_id=7)
+    await discord_bot.on_message(message)
+    
+    assert "wait 1 more seconds" in message.reply.await_args.args[0], message.reply.await_args.args[0]
+    request_bot.modify_image_with_replicate.assert_not_called()
+
+def test_bot_configuration(tmp_path):
+    """Test the bot's configuration defaults"""
+    # Import the bot in a fresh interpreter with the settings unset and .env
+    # loading disabled, so neither the developer's environment nor earlier
+    # imports can affect the result
+    env = {name: value for name, value in os.environ.items()
+           if name not in ('IMAGES_FOLDER', 'MAX_FILE_SIZE_MB')}
+    env['PYTHONPATH'] = os.pathsep.join(
+        filter(None, [os.path.dirname(os.path.abspath(discord_bot.__file__)), env.get('PYTHONPATH')])
+    )
+    # The values go to stderr, as the bot's log output shares stdout
+    script = (
+        "import json, sys\n"
+        "import dotenv; dotenv.load_dotenv = lambda *args, **kwargs: False\n"
+        "import discord_bot\n"
+        "json.dump([discord_bot.IMAGES_FOLDER, discord_bot.MAX_FILE_SIZE_MB], sys.stderr)"
+    )
+    result = subprocess.run([sys.executable, "-c", script], cwd=tmp_path, env=env,
+                            capture_output=True, text=True, check=True)
+    
+    images_folder, max_file_size_mb = json.loads(result.stderr.splitlines()[-1])
+    assert images_folder == IMAGES_FOLDER, "Default images folder not used"
+    assert max_file_size_mb == 25, "Default max file size not used"
 
 if __name__ == "__main__":
-    success = main()
-    exit(0 if success else 1)
\ No newline at end of file
+    sys.exit(pytest.main([__file__]))